@@ -1,13 +1,29 @@
 import os
-import json
-import sqlite3
-from typing import Optional, Dict, Any, Tuple
-
+import re
+import html
+import asyncio
+import time
+import hashlib
+import socket
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional, Dict, Any, Tuple, List, Union, Callable, Awaitable
+
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
-from cryptography.fernet import Fernet
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+try:
+    import uvloop  # optional: faster libuv-based event loop (not on Windows)
+except ImportError:
+    uvloop = None
+
+from telegram import Update, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -17,104 +33,233 @@ from telegram.ext import (
     filters,
 )
 
+from db import (
+    db_init,
+    db_get_key_enc,
+    db_delete_user,
+    cached_enc,
+    ais_connected,
+    key_writer,
+)
+
 # ----------------- ENV -----------------
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN", "").strip()
-FERNET_SECRET = os.getenv("FERNET_SECRET", "").strip()
-DB_PATH = os.getenv("DB_PATH", "bestproxy_bot.db").strip()
 API_BASE = os.getenv("BESTPROXY_API_BASE", "https://api.bestproxy.com").strip().rstrip("/")
 TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", "25"))
+# Threads for blocking work (API calls, SQLite); caps how many users' upstream
+# calls can be in flight at once
+API_WORKERS = int(os.getenv("API_WORKERS", "64"))
+# Webhook mode (optional): set PUBLIC_URL to receive updates via HTTPS instead of polling
+PUBLIC_URL = os.getenv("PUBLIC_URL", "").strip().rstrip("/")
+PORT = int(os.getenv("PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip()
 
 if not BOT_TOKEN:
     raise SystemExit("❌ BOT_TOKEN missing in .env")
-if not FERNET_SECRET:
-    raise SystemExit("❌ FERNET_SECRET missing in .env")
-
-fernet = Fernet(FERNET_SECRET.encode())
-
-# ----------------- DB -----------------
-def db_init():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS users(
-        tg_user_id INTEGER PRIMARY KEY,
-        api_key_enc TEXT,
-        created_at TEXT DEFAULT (datetime('now')),
-        updated_at TEXT DEFAULT (datetime('now'))
-    )
-    """)
-    conn.commit()
-    conn.close()
-
-def db_set_key(tg_user_id: int, api_key: str):
-    api_key_enc = fernet.encrypt(api_key.encode()).decode()
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-    INSERT INTO users(tg_user_id, api_key_enc, updated_at)
-    VALUES(?,?,datetime('now'))
-    ON CONFLICT(tg_user_id) DO UPDATE SET
-        api_key_enc=excluded.api_key_enc,
-        updated_at=datetime('now')
-    """, (tg_user_id, api_key_enc))
-    conn.commit()
-    conn.close()
-
-def db_get_key(tg_user_id: int) -> Optional[str]:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT api_key_enc FROM users WHERE tg_user_id=?", (tg_user_id,))
-    row = cur.fetchone()
-    conn.close()
-    if not row or not row[0]:
-        return None
-    return fernet.decrypt(row[0].encode()).decode()
-
-def db_delete_user(tg_user_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM users WHERE tg_user_id=?", (tg_user_id,))
-    conn.commit()
-    conn.close()
+if PUBLIC_URL and not WEBHOOK_SECRET:
+    raise SystemExit("❌ WEBHOOK_SECRET missing in .env (required with PUBLIC_URL)")
 
 # ----------------- BestProxy API Client -----------------
+# Seconds a successful GET stays fresh in the response cache (short for
+# traffic and IP lists, a minute for accounts, an hour for locations). Paths
+# not listed here are never cached.
+TTL_POLICY = {
+    "/gateway/user-usage-flow/total": 8,
+    "/gateway/ip/get-static-ip": 25,
+    "/gateway/whitelist-account/list": 60,
+    "/gateway/ip/dynamic-states": 3600,
+    "/gateway/ip/dynamic-states/search": 3600,
+    "/gateway/ip/dynamic-citys": 3600,
+    "/gateway/ip/dynamic-citys/search": 3600,
+}
+RESP_CACHE_MAX = 4096
+# POST path prefix -> cached GET paths it can change; other POSTs drop
+# everything cached for that key
+INVALIDATES = {
+    "/gateway/whitelist-account/": ("/gateway/whitelist-account/list",),
+}
+JSON_HEADERS = {"Content-Type": "application/json"}
+# List views only ever show a few KB, so their bodies are read at most this far
+MAX_VIEW_BYTES = 64 * 1024
+
+# (owner, path, params) -> (stale_at, resp); owner is a hash of the app_key and
+# params is its canonical (sorted-key) JSON
+_RESP_CACHE: "OrderedDict[Tuple[str, str, bytes], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_KEY_OPTS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+_RESP_LOCK = threading.Lock()
+
+def _drop_cached(owner: str, paths: Optional[Tuple[str, ...]] = None):
+    with _RESP_LOCK:
+        for key in [k for k in _RESP_CACHE if k[0] == owner and (paths is None or k[1] in paths)]:
+            del _RESP_CACHE[key]
+
+@lru_cache(maxsize=128)
+def invalidated_by(path: str) -> Optional[Tuple[str, ...]]:
+    for prefix, paths in INVALIDATES.items():
+        if path.startswith(prefix):
+            return paths
+    return None
+
+# TCP keepalive on pooled sockets, so a connection the far end dropped while
+# idle is noticed and replaced instead of failing the next request. The
+# idle/interval knobs are Linux-only; elsewhere plain SO_KEEPALIVE is used.
+_KEEPALIVE_OPTS = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+if hasattr(socket, "TCP_KEEPIDLE"):
+    _KEEPALIVE_OPTS += [
+        (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60),
+        (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 15),
+        (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 4),
+    ]
+
+class KeepAliveAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = _KEEPALIVE_OPTS
+        super().init_poolmanager(*args, **kwargs)
+
+# One connection pool for every user's client: all calls go to the same host
+# and each request carries its own app_key, so sockets can be shared safely.
+# Connect errors are retried for every method (nothing was sent yet); status
+# retries keep urllib3's default of idempotent methods only, so POSTs are
+# never replayed. Retry-After is ignored: a 429 may ask for hours of sleep,
+# far past TIMEOUT, so retries use the short backoff instead.
+_ADAPTER = KeepAliveAdapter(
+    pool_connections=8,
+    pool_maxsize=128,
+    pool_block=False,
+    max_retries=Retry(total=3, connect=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504],
+                      raise_on_status=False, respect_retry_after_header=False),
+)
+
+@lru_cache(maxsize=128)
+def api_url(path: str) -> str:
+    # API_BASE is fixed for the process, so each path is joined only once
+    if not path.startswith("/"):
+        path = "/" + path
+    return API_BASE + path
+
 class BestProxyAPI:
     """
     Official base: https://api.bestproxy.com
     Auth: app_key in query (GET) OR in body (POST)
     Response: {"code":200,"msg":"...","data":...}
+
+    Each client has its own requests.Session (so cookies stay per user) but
+    all of them mount the shared _ADAPTER, so TCP/TLS connections to the API
+    are reused across calls and across users.
     """
     def __init__(self, app_key: str):
         self.app_key = app_key
+        self.owner = hashlib.blake2b(app_key.encode(), digest_size=16).hexdigest()
+        self.session = requests.Session()
+        self.session.mount("https://", _ADAPTER)
+        self.session.mount("http://", _ADAPTER)
+        self.session.headers.update({"User-Agent": "bestproxy-bot/1.0", "Accept": "application/json"})
+        # Built once and only read from here on. Not set as session.params:
+        # requests would then also put the key in the query string of POSTs.
+        self._auth = {"app_key": app_key}
+
+    def close(self):
+        # Session.close() would close the shared _ADAPTER's pool for everyone;
+        # the only per-client state left to drop is the cookie jar.
+        self.session.cookies.clear()
+
+    def __enter__(self) -> "BestProxyAPI":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, path: str, params: Optional[Dict[str, Any]] = None, max_bytes: Optional[int] = None) -> Dict[str, Any]:
+        """
+        GET with a read-through cache for paths in TTL_POLICY.
+        If the upstream call fails but an expired entry exists, that entry is
+        returned with "stale": True instead of raising.
+        With max_bytes, the body is streamed and cut off at that size; a cut
+        response is {"http":..., "json": {"raw": <prefix>}, "truncated": True}.
+        """
+        ttl = TTL_POLICY.get(path)
+        if ttl is None:
+            return self._get(path, params, max_bytes)
+
+        key = (self.owner, path, orjson.dumps(params or {}, option=_KEY_OPTS, default=str))
+        started = time.monotonic()
+        with _RESP_LOCK:
+            entry = _RESP_CACHE.get(key)
+        # a body cut at max_bytes only satisfies callers that also set a cap
+        if entry and entry[1].get("truncated") and max_bytes is None:
+            entry = None
+        if entry and started < entry[0]:
+            return entry[1]
 
-    def _url(self, path: str) -> str:
-        if not path.startswith("/"):
-            path = "/" + path
-        return API_BASE + path
-
-    def get(self, path: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        params = dict(params or {})
-        params["app_key"] = self.app_key
-        r = requests.get(self._url(path), params=params, timeout=TIMEOUT)
-        return self._pack(r)
+        try:
+            resp = self._get(path, params, max_bytes)
+        except requests.RequestException:
+            if entry:
+                return {**entry[1], "stale": True}
+            raise
+
+        if ok_api(resp)[0]:
+            done = time.monotonic()
+            with _RESP_LOCK:
+                _RESP_CACHE[key] = (done + ttl + min(done - started, 5), resp)
+                _RESP_CACHE.move_to_end(key)
+                while len(_RESP_CACHE) > RESP_CACHE_MAX:
+                    _RESP_CACHE.popitem(last=False)
+        return resp
 
     def post(self, path: str, body: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        payload = dict(body or {})
-        payload["app_key"] = self.app_key
-        r = requests.post(self._url(path), json=payload, timeout=TIMEOUT)
-        return self._pack(r)
-
-    def _pack(self, r: requests.Response) -> Dict[str, Any]:
+        payload = {**body, **self._auth} if body else self._auth
+        try:
+            r = self.session.post(api_url(path), data=orjson.dumps(payload), headers=JSON_HEADERS, timeout=TIMEOUT)
+        finally:
+            # even a failed call (e.g. read timeout) may have been applied upstream
+            _drop_cached(self.owner, invalidated_by(path))
+        return self._pack(r.status_code, r.content)
+
+    # Async wrappers for the handlers: the blocking HTTP call runs on a worker
+    # thread so one slow upstream request doesn't stall every other user.
+    async def aget(self, path: str, params: Optional[Dict[str, Any]] = None, max_bytes: Optional[int] = None) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.get, path, params, max_bytes)
+
+    async def apost(self, path: str, body: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.post, path, body)
+
+    async def get_many(self, specs: List[Tuple[str, Optional[Dict[str, Any]]]],
+                       max_bytes: Optional[int] = None) -> List[Any]:
+        """
+        Run independent GETs concurrently: [(path, params), ...] -> results in
+        the same order. A failed call yields its exception instead of raising.
+        """
+        return await asyncio.gather(*(self.aget(p, params, max_bytes) for p, params in specs), return_exceptions=True)
+
+    def _get(self, path: str, params: Optional[Dict[str, Any]] = None, max_bytes: Optional[int] = None) -> Dict[str, Any]:
+        params = {**params, **self._auth} if params else self._auth
+        if max_bytes is None:
+            r = self.session.get(api_url(path), params=params, timeout=TIMEOUT)
+            return self._pack(r.status_code, r.content)
+
+        with self.session.get(api_url(path), params=params, timeout=TIMEOUT, stream=True) as r:
+            buf = bytearray()
+            for chunk in r.iter_content(chunk_size=8192):
+                buf += chunk
+                if len(buf) > max_bytes:
+                    raw = bytes(buf[:max_bytes]).decode(errors="replace")
+                    return {"http": r.status_code, "json": {"raw": raw}, "truncated": True}
+            return self._pack(r.status_code, bytes(buf))
+
+    def _pack(self, status: int, content: bytes) -> Dict[str, Any]:
         try:
-            data = r.json()
-        except Exception:
-            data = {"raw": r.text}
-        return {"http": r.status_code, "json": data}
+            data = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            data = {"raw": content.decode(errors="replace")}
+        return {"http": status, "json": data}
 
 def ok_api(resp: Dict[str, Any]) -> Tuple[bool, str]:
     if resp.get("http", 0) >= 400:
         return False, f"HTTP {resp.get('http')}"
+    if resp.get("truncated"):
+        return True, "OK (truncated)"
 
     j = resp.get("json", {})
     # bestproxy format: code == 200 success
@@ -124,12 +269,67 @@ def ok_api(resp: Dict[str, Any]) -> Tuple[bool, str]:
         return True, msg or "OK"
     return False, f"code={code} msg={msg}"
 
+def body(resp: Dict[str, Any]) -> Any:
+    # a truncated response only has the raw text prefix to show
+    return resp["json"]["raw"] if resp.get("truncated") else resp["json"]
+
+PRETTY_LIST_HEAD = 50
+_PRETTY_OPTS = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+
+def _head(obj: Any, n: int) -> Tuple[Any, bool]:
+    """Copy of obj with every list cut to its first n items, plus whether anything was cut."""
+    if isinstance(obj, list):
+        cut = len(obj) > n
+        items = []
+        for v in obj[:n]:
+            v, c = _head(v, n)
+            cut = cut or c
+            items.append(v)
+        return items, cut
+    if isinstance(obj, dict):
+        cut = False
+        out = {}
+        for k, v in obj.items():
+            v, c = _head(v, n)
+            cut = cut or c
+            out[k] = v
+        return out, cut
+    return obj, False
+
 def pretty(obj: Any, max_len: int = 3500) -> str:
-    s = json.dumps(obj, ensure_ascii=False, indent=2)
-    if len(s) > max_len:
+    if isinstance(obj, str):
+        s, cut = obj, False
+    else:
+        compact = orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        cut = False
+        if len(compact) > max_len * 4:
+            # most of it would be trimmed anyway: only indent the head of each list
+            obj, cut = _head(obj, PRETTY_LIST_HEAD)
+        s = orjson.dumps(obj, option=_PRETTY_OPTS).decode()
+    if len(s) > max_len or cut:
         return s[:max_len] + "\n... (trimmed)"
     return s
 
+def pre(obj: Any, max_len: int = 3500) -> str:
+    # HTML <pre> block for parse_mode="HTML"; unlike Markdown it can't be
+    # broken by backticks or underscores in the payload
+    return f"<pre>{html.escape(pretty(obj, max_len), quote=False)}</pre>"
+
+def full_json(obj: Any, max_len: int = 3500) -> Optional[bytes]:
+    # the untrimmed JSON, only when pre() would have to cut it
+    if isinstance(obj, str):
+        return None
+    data = orjson.dumps(obj, option=_PRETTY_OPTS)
+    # measured in characters, like pretty(): non-ASCII text is several bytes each
+    return data if len(data) > max_len and len(data.decode()) > max_len else None
+
+async def send_full(message, obj: Any, filename: str):
+    # a long result keeps its trimmed preview in the chat and also goes out
+    # whole as a .json file, instead of being cut at the message size limit
+    data = full_json(obj)
+    if data is not None:
+        await message.reply_document(document=data, filename=filename)
+
 # ----------------- UI / States -----------------
 S_WAIT_KEY = "wait_key"
 S_WAIT_ADD_ACCOUNTS = "wait_add_accounts"
@@ -144,84 +344,140 @@ S_WAIT_STATIC_FILTER = "wait_static_filter"
 S_WAIT_STATE_SEARCH = "wait_state_search"
 S_WAIT_CITY_SEARCH = "wait_city_search"
 
-def menu(connected: bool) -> InlineKeyboardMarkup:
-    if not connected:
-        kb = [
-            [InlineKeyboardButton("🔗 Connect API Key", callback_data="connect")],
-            [InlineKeyboardButton("ℹ️ Help", callback_data="help")]
-        ]
-        return InlineKeyboardMarkup(kb)
-
-    kb = [
-        [InlineKeyboardButton("👥 Proxy Accounts", callback_data="acc_menu"),
-         InlineKeyboardButton("📊 Traffic (Daily)", callback_data="flow_menu")],
-        [InlineKeyboardButton("🌍 Locations", callback_data="loc_menu"),
-         InlineKeyboardButton("🧷 Static IPs", callback_data="static_menu")],
-        [InlineKeyboardButton("❌ Disconnect", callback_data="disconnect"),
-         InlineKeyboardButton("ℹ️ Help", callback_data="help")],
-    ]
-    return InlineKeyboardMarkup(kb)
-
-def acc_menu() -> InlineKeyboardMarkup:
-    kb = [
-        [InlineKeyboardButton("📋 List", callback_data="acc_list")],
-        [InlineKeyboardButton("➕ Add (bulk)", callback_data="acc_add"),
-         InlineKeyboardButton("🗑️ Delete (bulk)", callback_data="acc_del")],
-        [InlineKeyboardButton("✅ Enable", callback_data="acc_en"),
-         InlineKeyboardButton("🚫 Disable", callback_data="acc_dis")],
-        [InlineKeyboardButton("🔑 Change Pass", callback_data="acc_pass"),
-         InlineKeyboardButton("📝 Change Remark", callback_data="acc_remark")],
-        [InlineKeyboardButton("📦 Change Limit(GB)", callback_data="acc_limit")],
-        [InlineKeyboardButton("⬅️ Back", callback_data="back")],
-    ]
-    return InlineKeyboardMarkup(kb)
-
-def flow_menu() -> InlineKeyboardMarkup:
-    kb = [
-        [InlineKeyboardButton("📅 Last 7 Days (default)", callback_data="flow_default")],
-        [InlineKeyboardButton("🕒 Custom start_time", callback_data="flow_custom")],
-        [InlineKeyboardButton("⬅️ Back", callback_data="back")],
-    ]
-    return InlineKeyboardMarkup(kb)
-
-def loc_menu() -> InlineKeyboardMarkup:
-    kb = [
-        [InlineKeyboardButton("🏷️ States list", callback_data="states_list"),
-         InlineKeyboardButton("🔎 States search", callback_data="states_search")],
-        [InlineKeyboardButton("🏙️ Cities list", callback_data="cities_list"),
-         InlineKeyboardButton("🔎 Cities search", callback_data="cities_search")],
-        [InlineKeyboardButton("⬅️ Back", callback_data="back")],
-    ]
-    return InlineKeyboardMarkup(kb)
+_WAIT_KEYS = frozenset({
+    S_WAIT_KEY, S_WAIT_ADD_ACCOUNTS, S_WAIT_DEL_ACCOUNTS, S_WAIT_EN_ACCOUNTS, S_WAIT_DIS_ACCOUNTS,
+    S_WAIT_CH_PASS, S_WAIT_CH_REMARK, S_WAIT_CH_LIMIT, S_WAIT_FLOW_START,
+    S_WAIT_STATIC_FILTER, S_WAIT_STATE_SEARCH, S_WAIT_CITY_SEARCH,
+})
+
+# Proxy account usernames; checked locally so typos don't cost an API round-trip
+ACCOUNT_RE = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+# One entry of a bulk add: username, optionally ":password"
+ACCOUNT_PASS_RE = re.compile(r"^[A-Za-z0-9_.-]{1,64}(:[^,\s]{1,128})?$")
+# Bulk account lists are sent in POSTs of at most this many entries
+ACCOUNTS_PER_POST = 100
+# ISO 3166-1 alpha-2 country code, checked after .upper()
+_CC_RE = re.compile(r"^[A-Z]{2}$")
+
+# Keyboards are immutable, so each one is built once at import and shared.
+START_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔗 Connect API Key", callback_data="connect")],
+    [InlineKeyboardButton("ℹ️ Help", callback_data="help")]
+])
+
+MAIN_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🧭 Dashboard", callback_data="dashboard")],
+    [InlineKeyboardButton("👥 Proxy Accounts", callback_data="acc_menu"),
+     InlineKeyboardButton("📊 Traffic (Daily)", callback_data="flow_menu")],
+    [InlineKeyboardButton("🌍 Locations", callback_data="loc_menu"),
+     InlineKeyboardButton("🧷 Static IPs", callback_data="static_menu")],
+    [InlineKeyboardButton("❌ Disconnect", callback_data="disconnect"),
+     InlineKeyboardButton("ℹ️ Help", callback_data="help")],
+])
+
+ACC_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📋 List", callback_data="acc_list")],
+    [InlineKeyboardButton("➕ Add (bulk)", callback_data="acc_add"),
+     InlineKeyboardButton("🗑️ Delete (bulk)", callback_data="acc_del")],
+    [InlineKeyboardButton("✅ Enable", callback_data="acc_en"),
+     InlineKeyboardButton("🚫 Disable", callback_data="acc_dis")],
+    [InlineKeyboardButton("🔑 Change Pass", callback_data="acc_pass"),
+     InlineKeyboardButton("📝 Change Remark", callback_data="acc_remark")],
+    [InlineKeyboardButton("📦 Change Limit(GB)", callback_data="acc_limit")],
+    [InlineKeyboardButton("⬅️ Back", callback_data="back")],
+])
+
+FLOW_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📅 Last 7 Days (default)", callback_data="flow_default")],
+    [InlineKeyboardButton("🕒 Custom start_time", callback_data="flow_custom")],
+    [InlineKeyboardButton("⬅️ Back", callback_data="back")],
+])
+
+LOC_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🏷️ States list", callback_data="states_list"),
+     InlineKeyboardButton("🔎 States search", callback_data="states_search")],
+    [InlineKeyboardButton("🏙️ Cities list", callback_data="cities_list"),
+     InlineKeyboardButton("🔎 Cities search", callback_data="cities_search")],
+    [InlineKeyboardButton("⬅️ Back", callback_data="back")],
+])
+
+STATIC_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🧷 Get static IPs", callback_data="static_get")],
+    [InlineKeyboardButton("⚙️ Get with filters", callback_data="static_filter")],
+    [InlineKeyboardButton("⬅️ Back", callback_data="back")],
+])
 
-def static_menu() -> InlineKeyboardMarkup:
-    kb = [
-        [InlineKeyboardButton("🧷 Get static IPs", callback_data="static_get")],
-        [InlineKeyboardButton("⚙️ Get with filters", callback_data="static_filter")],
-        [InlineKeyboardButton("⬅️ Back", callback_data="back")],
-    ]
-    return InlineKeyboardMarkup(kb)
+def menu(connected: bool) -> InlineKeyboardMarkup:
+    return MAIN_MENU if connected else START_MENU
 
 def clear_states(context: ContextTypes.DEFAULT_TYPE):
-    for k in list(context.user_data.keys()):
-        if k.startswith("wait_") or k in (
-            S_WAIT_KEY, S_WAIT_ADD_ACCOUNTS, S_WAIT_DEL_ACCOUNTS, S_WAIT_EN_ACCOUNTS, S_WAIT_DIS_ACCOUNTS,
-            S_WAIT_CH_PASS, S_WAIT_CH_REMARK, S_WAIT_CH_LIMIT, S_WAIT_FLOW_START,
-            S_WAIT_STATIC_FILTER, S_WAIT_STATE_SEARCH, S_WAIT_CITY_SEARCH
-        ):
-            context.user_data.pop(k, None)
+    for k in _WAIT_KEYS:
+        context.user_data.pop(k, None)
+
+# ----------------- API client cache -----------------
+# One BestProxyAPI per user, reused across updates so we skip the DB read +
+# key decrypt and keep the user's HTTP session warm. Each entry remembers the
+# api_key_enc it was built from; once the key cache holds a different value (key
+# replaced or removed) the entry is stale and gets rebuilt.
+CLIENT_CACHE_MAX = 512
+CLIENT_CACHE_TTL = 600  # seconds
+
+_CLIENT_CACHE: "OrderedDict[int, Tuple[float, Union[str, bytes], BestProxyAPI]]" = OrderedDict()
+_CLIENT_LOCK = threading.Lock()
+
+def drop_api(tg_user_id: int):
+    with _CLIENT_LOCK:
+        entry = _CLIENT_CACHE.pop(tg_user_id, None)
+    if entry:
+        entry[2].close()
+
+def _cached_api(tg_user_id: int) -> Optional[BestProxyAPI]:
+    with _CLIENT_LOCK:
+        entry = _CLIENT_CACHE.get(tg_user_id)
+        if (entry and time.monotonic() - entry[0] < CLIENT_CACHE_TTL
+                and entry[1] == cached_enc(tg_user_id)):
+            _CLIENT_CACHE.move_to_end(tg_user_id)
+            return entry[2]
+    if entry:
+        drop_api(tg_user_id)
+    return None
 
 def get_api(update: Update) -> Optional[BestProxyAPI]:
     tg_id = update.effective_user.id
-    k = db_get_key(tg_id)
+    api = _cached_api(tg_id)
+    if api:
+        return api
+
+    now = time.monotonic()
+    # the client is versioned by the blob its key came from, never by a
+    # second read that a concurrent save could have changed
+    k, enc = db_get_key_enc(tg_id)
     if not k:
         return None
-    return BestProxyAPI(k)
+    api = BestProxyAPI(k)
+
+    evicted = []
+    with _CLIENT_LOCK:
+        _CLIENT_CACHE[tg_id] = (now, enc, api)
+        _CLIENT_CACHE.move_to_end(tg_id)
+        while len(_CLIENT_CACHE) > CLIENT_CACHE_MAX:
+            evicted.append(_CLIENT_CACHE.popitem(last=False)[1][2])
+    for old in evicted:
+        old.close()
+    return api
+
+# Async form for the handlers: cache hits stay on the event loop, only
+# misses (SQLite read / decrypt) go to the thread pool.
+async def aget_api(update: Update) -> Optional[BestProxyAPI]:
+    api = _cached_api(update.effective_user.id)
+    if api:
+        return api
+    return await asyncio.to_thread(get_api, update)
 
 # ----------------- Commands -----------------
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     tg_id = update.effective_user.id
-    connected = db_get_key(tg_id) is not None
+    connected = await ais_connected(tg_id)
     text = (
         "👋 *BestProxy Multi-User Bot*\n\n"
         "✅ Login লাগে না—শুধু `app_key` দিলেই হবে\n"
@@ -232,231 +488,199 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cmd_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     clear_states(context)
-    connected = db_get_key(update.effective_user.id) is not None
+    connected = await ais_connected(update.effective_user.id)
     await update.message.reply_text("✅ Cancelled.", reply_markup=menu(connected))
 
 # ----------------- Buttons -----------------
+async def btn_help(q: CallbackQuery, context: ContextTypes.DEFAULT_TYPE, connected: bool):
+    await q.edit_message_text(
+        "ℹ️ *Help*\n\n"
+        "1) Dashboard থেকে `App_key` copy করো\n"
+        "2) Bot এ `Connect API Key` চাপো\n"
+        "3) Key paste করো\n\n"
+        "⚠️ Key admin-level—কাউকে দিও না।",
+        parse_mode="Markdown",
+        reply_markup=menu(connected),
+    )
+
+async def btn_connect(q: CallbackQuery, context: ContextTypes.DEFAULT_TYPE, connected: bool):
+    clear_states(context)
+    context.user_data[S_WAIT_KEY] = True
+    await q.edit_message_text(
+        "🔑 এখন তোমার *App_key* paste করো.\n\nCancel: `/cancel`",
+        parse_mode="Markdown",
+    )
+
+async def btn_disconnect(q: CallbackQuery, context: ContextTypes.DEFAULT_TYPE, connected: bool):
+    tg_id = q.from_user.id
+    await asyncio.to_thread(db_delete_user, tg_id)
+    drop_api(tg_id)
+    clear_states(context)
+    await q.edit_message_text("✅ Disconnected. Your key removed.", reply_markup=START_MENU)
+
+async def btn_dashboard(q: CallbackQuery, context: ContextTypes.DEFAULT_TYPE, api: BestProxyAPI):
+    sections = [
+        ("📋 <b>Accounts</b>", "/gateway/whitelist-account/list"),
+        ("📊 <b>Usage Flow (Daily)</b>", "/gateway/user-usage-flow/total"),
+        ("🧷 <b>Static IPs</b>", "/gateway/ip/get-static-ip"),
+    ]
+    results = await api.get_many([(path, None) for _, path in sections], max_bytes=MAX_VIEW_BYTES)
+    parts = ["🧭 <b>Dashboard</b>"]
+    for (title, _), resp in zip(sections, results):
+        if isinstance(resp, Exception):
+            parts.append(f"{title}\n❌ Failed: {type(resp).__name__}")
+            continue
+        ok, msg = ok_api(resp)
+        if not ok:
+            parts.append(f"{title}\n❌ Failed: {html.escape(msg)}")
+            continue
+        parts.append(f"{title}\n{pre(body(resp), max_len=1100)}")
+    await q.edit_message_text("\n\n".join(parts), parse_mode="HTML", reply_markup=MAIN_MENU)
+
+# Buttons that work without a key: callback_data -> handler(q, context, connected)
+PUBLIC_BUTTONS: Dict[str, Callable[..., Awaitable[None]]] = {
+    "help": btn_help,
+    "connect": btn_connect,
+    "disconnect": btn_disconnect,
+}
+
+# callback_data -> (title, submenu)
+SUBMENUS: Dict[str, Tuple[str, InlineKeyboardMarkup]] = {
+    "back": ("⬅️ Back to main menu", MAIN_MENU),
+    "acc_menu": ("👥 *Proxy Accounts Menu*", ACC_MENU),
+    "flow_menu": ("📊 *Traffic / Usage Menu*", FLOW_MENU),
+    "loc_menu": ("🌍 *Locations Menu*", LOC_MENU),
+    "static_menu": ("🧷 *Static IP Menu*", STATIC_MENU),
+}
+
+# Buttons that ask for text input: callback_data -> (state key, prompt)
+PROMPTS: Dict[str, Tuple[str, str]] = {
+    "acc_add": (S_WAIT_ADD_ACCOUNTS, "➕ *Add Accounts (bulk)*\n\nFormat:\n`user01:pass,user02:pass`\n\nCancel: `/cancel`"),
+    "acc_del": (S_WAIT_DEL_ACCOUNTS, "🗑️ *Delete Accounts (bulk)*\n\nFormat:\n`user01,user02`\n\nCancel: `/cancel`"),
+    "acc_en": (S_WAIT_EN_ACCOUNTS, "✅ *Enable Accounts*\n\nSend: `user01,user02`\nCancel: `/cancel`"),
+    "acc_dis": (S_WAIT_DIS_ACCOUNTS, "🚫 *Disable Accounts*\n\nSend: `user01,user02`\nCancel: `/cancel`"),
+    "acc_pass": (S_WAIT_CH_PASS, "🔑 *Change Password*\n\nFormat:\n`username newpassword`\nExample: `user01 pass123`\nCancel: `/cancel`"),
+    "acc_remark": (S_WAIT_CH_REMARK, "📝 *Change Remark*\n\nFormat:\n`username | remark text`\nExample: `user01 | my test account`\nCancel: `/cancel`"),
+    "acc_limit": (S_WAIT_CH_LIMIT, "📦 *Change Limit (GB)*\n\nFormat:\n`username limitGB`\nExample: `user01 50`\n0 দিলে unlimited\nCancel: `/cancel`"),
+    "flow_custom": (S_WAIT_FLOW_START, "🕒 *Custom start_time*\n\nSend start_time like:\n`2026-02-01 00:00:00`\n\nCancel: `/cancel`"),
+    "states_search": (S_WAIT_STATE_SEARCH, "🔎 *States search*\n\nSend country_code like:\n`US`\nCancel: `/cancel`"),
+    "cities_search": (S_WAIT_CITY_SEARCH, "🔎 *Cities search*\n\nSend like:\n`country_code state`\nExample: `US CA`\nCancel: `/cancel`"),
+    "static_filter": (
+        S_WAIT_STATIC_FILTER,
+        "⚙️ *Static IP filters*\n\n"
+        "Send JSON filters (any of these):\n"
+        "`{\"country_code\":\"US\",\"product_type\":25,\"page\":1,\"size\":20}`\n\n"
+        "product_type: 25=Static Residential, 14=Datacenter\n"
+        "status: 1 valid, 2 invalid, 3 expiring, 4 maintenance\n\n"
+        "Cancel: `/cancel`",
+    ),
+}
+
+# Buttons that show a GET result: callback_data -> (path, HTML title, submenu)
+VIEWS: Dict[str, Tuple[str, str, InlineKeyboardMarkup]] = {
+    "acc_list": ("/gateway/whitelist-account/list", "📋 <b>Accounts</b>", ACC_MENU),
+    "flow_default": ("/gateway/user-usage-flow/total", "📊 <b>Usage Flow (Daily)</b>", FLOW_MENU),
+    "states_list": ("/gateway/ip/dynamic-states", "🏷️ <b>States List</b>", LOC_MENU),
+    "cities_list": ("/gateway/ip/dynamic-citys", "🏙️ <b>Cities List</b>", LOC_MENU),
+    "static_get": ("/gateway/ip/get-static-ip", "🧷 <b>Static IPs</b>", STATIC_MENU),
+}
+
+# Other connected-only buttons: callback_data -> handler(q, context, api)
+DISPATCH: Dict[str, Callable[..., Awaitable[None]]] = {
+    "dashboard": btn_dashboard,
+}
+
 async def on_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
     tg_id = q.from_user.id
-    connected = db_get_key(tg_id) is not None
+    # one lookup serves both checks when the user's client is cached
+    api = _cached_api(tg_id)
+    connected = api is not None or await ais_connected(tg_id)
 
     data = q.data
 
-    if data == "help":
-        await q.edit_message_text(
-            "ℹ️ *Help*\n\n"
-            "1) Dashboard থেকে `App_key` copy করো\n"
-            "2) Bot এ `Connect API Key` চাপো\n"
-            "3) Key paste করো\n\n"
-            "⚠️ Key admin-level—কাউকে দিও না।",
-            parse_mode="Markdown",
-            reply_markup=menu(connected),
-        )
-        return
-
-    if data == "connect":
-        clear_states(context)
-        context.user_data[S_WAIT_KEY] = True
-        await q.edit_message_text(
-            "🔑 এখন তোমার *App_key* paste করো.\n\nCancel: `/cancel`",
-            parse_mode="Markdown",
-        )
-        return
-
-    if data == "disconnect":
-        db_delete_user(tg_id)
-        clear_states(context)
-        await q.edit_message_text("✅ Disconnected. Your key removed.", reply_markup=menu(False))
+    handler = PUBLIC_BUTTONS.get(data)
+    if handler:
+        await handler(q, context, connected)
         return
 
     # need connected for below menus
     if not connected:
-        await q.edit_message_text("⚠️ আগে Connect করো।", reply_markup=menu(False))
-        return
-
-    if data == "back":
-        await q.edit_message_text("⬅️ Back to main menu", reply_markup=menu(True))
-        return
-
-    if data == "acc_menu":
-        await q.edit_message_text("👥 *Proxy Accounts Menu*", parse_mode="Markdown", reply_markup=acc_menu())
-        return
-
-    if data == "flow_menu":
-        await q.edit_message_text("📊 *Traffic / Usage Menu*", parse_mode="Markdown", reply_markup=flow_menu())
-        return
-
-    if data == "loc_menu":
-        await q.edit_message_text("🌍 *Locations Menu*", parse_mode="Markdown", reply_markup=loc_menu())
+        await q.edit_message_text("⚠️ আগে Connect করো।", reply_markup=START_MENU)
         return
 
-    if data == "static_menu":
-        await q.edit_message_text("🧷 *Static IP Menu*", parse_mode="Markdown", reply_markup=static_menu())
+    if data in SUBMENUS:
+        title, submenu = SUBMENUS[data]
+        await q.edit_message_text(title, parse_mode="Markdown", reply_markup=submenu)
         return
 
-    api = get_api(update)
+    if api is None:
+        api = await aget_api(update)
     if not api:
-        await q.edit_message_text("⚠️ Key missing. Please /start again.", reply_markup=menu(False))
-        return
-
-    # -------- Accounts actions --------
-    if data == "acc_list":
-        resp = api.get("/gateway/whitelist-account/list")
-        ok, msg = ok_api(resp)
-        if not ok:
-            await q.edit_message_text(f"❌ Failed: {msg}\n```{pretty(resp)}```", parse_mode="Markdown", reply_markup=acc_menu())
-            return
-        await q.edit_message_text(f"📋 *Accounts*\n```{pretty(resp['json'])}```", parse_mode="Markdown", reply_markup=acc_menu())
+        await q.edit_message_text("⚠️ Key missing. Please /start again.", reply_markup=START_MENU)
         return
 
-    if data == "acc_add":
+    if data in PROMPTS:
+        state, prompt = PROMPTS[data]
         clear_states(context)
-        context.user_data[S_WAIT_ADD_ACCOUNTS] = True
-        await q.edit_message_text(
-            "➕ *Add Accounts (bulk)*\n\n"
-            "Format:\n"
-            "`user01:pass,user02:pass`\n\n"
-            "Cancel: `/cancel`",
-            parse_mode="Markdown",
-        )
+        context.user_data[state] = True
+        await q.edit_message_text(prompt, parse_mode="Markdown")
         return
 
-    if data == "acc_del":
-        clear_states(context)
-        context.user_data[S_WAIT_DEL_ACCOUNTS] = True
-        await q.edit_message_text(
-            "🗑️ *Delete Accounts (bulk)*\n\n"
-            "Format:\n"
-            "`user01,user02`\n\n"
-            "Cancel: `/cancel`",
-            parse_mode="Markdown",
-        )
-        return
-
-    if data == "acc_en":
-        clear_states(context)
-        context.user_data[S_WAIT_EN_ACCOUNTS] = True
-        await q.edit_message_text("✅ *Enable Accounts*\n\nSend: `user01,user02`\nCancel: `/cancel`", parse_mode="Markdown")
-        return
-
-    if data == "acc_dis":
-        clear_states(context)
-        context.user_data[S_WAIT_DIS_ACCOUNTS] = True
-        await q.edit_message_text("🚫 *Disable Accounts*\n\nSend: `user01,user02`\nCancel: `/cancel`", parse_mode="Markdown")
-        return
-
-    if data == "acc_pass":
-        clear_states(context)
-        context.user_data[S_WAIT_CH_PASS] = True
-        await q.edit_message_text(
-            "🔑 *Change Password*\n\nFormat:\n`username newpassword`\nExample: `user01 pass123`\nCancel: `/cancel`",
-            parse_mode="Markdown",
-        )
-        return
-
-    if data == "acc_remark":
-        clear_states(context)
-        context.user_data[S_WAIT_CH_REMARK] = True
-        await q.edit_message_text(
-            "📝 *Change Remark*\n\nFormat:\n`username | remark text`\nExample: `user01 | my test account`\nCancel: `/cancel`",
-            parse_mode="Markdown",
-        )
-        return
-
-    if data == "acc_limit":
-        clear_states(context)
-        context.user_data[S_WAIT_CH_LIMIT] = True
-        await q.edit_message_text(
-            "📦 *Change Limit (GB)*\n\nFormat:\n`username limitGB`\nExample: `user01 50`\n0 দিলে unlimited\nCancel: `/cancel`",
-            parse_mode="Markdown",
-        )
-        return
-
-    # -------- Flow actions --------
-    if data == "flow_default":
-        resp = api.get("/gateway/user-usage-flow/total")
+    if data in VIEWS:
+        path, title, submenu = VIEWS[data]
+        resp = await api.aget(path, max_bytes=MAX_VIEW_BYTES)
         ok, msg = ok_api(resp)
         if not ok:
-            await q.edit_message_text(f"❌ Failed: {msg}\n```{pretty(resp)}```", parse_mode="Markdown", reply_markup=flow_menu())
+            await q.edit_message_text(f"❌ Failed: {html.escape(msg)}\n{pre(resp)}", parse_mode="HTML", reply_markup=submenu)
             return
-        await q.edit_message_text(f"📊 *Usage Flow (Daily)*\n```{pretty(resp['json'])}```", parse_mode="Markdown", reply_markup=flow_menu())
+        await q.edit_message_text(f"{title}\n{pre(body(resp))}", parse_mode="HTML", reply_markup=submenu)
+        await send_full(q.message, body(resp), f"{data}.json")
         return
 
-    if data == "flow_custom":
-        clear_states(context)
-        context.user_data[S_WAIT_FLOW_START] = True
-        await q.edit_message_text(
-            "🕒 *Custom start_time*\n\nSend start_time like:\n`2026-02-01 00:00:00`\n\nCancel: `/cancel`",
-            parse_mode="Markdown",
-        )
+    handler = DISPATCH.get(data)
+    if handler:
+        await handler(q, context, api)
         return
 
-    # -------- Locations actions --------
-    if data == "states_list":
-        resp = api.get("/gateway/ip/dynamic-states")
-        ok, msg = ok_api(resp)
-        if not ok:
-            await q.edit_message_text(f"❌ Failed: {msg}\n```{pretty(resp)}```", parse_mode="Markdown", reply_markup=loc_menu())
-            return
-        await q.edit_message_text(f"🏷️ *States List*\n```{pretty(resp['json'])}```", parse_mode="Markdown", reply_markup=loc_menu())
-        return
+    await q.edit_message_text("⚠️ Unknown action", reply_markup=MAIN_MENU)
 
-    if data == "states_search":
-        clear_states(context)
-        context.user_data[S_WAIT_STATE_SEARCH] = True
-        await q.edit_message_text(
-            "🔎 *States search*\n\nSend country_code like:\n`US`\nCancel: `/cancel`",
-            parse_mode="Markdown",
-        )
-        return
-
-    if data == "cities_list":
-        resp = api.get("/gateway/ip/dynamic-citys")
-        ok, msg = ok_api(resp)
-        if not ok:
-            await q.edit_message_text(f"❌ Failed: {msg}\n```{pretty(resp)}```", parse_mode="Markdown", reply_markup=loc_menu())
-            return
-        await q.edit_message_text(f"🏙️ *Cities List*\n```{pretty(resp['json'])}```", parse_mode="Markdown", reply_markup=loc_menu())
-        return
-
-    if data == "cities_search":
-        clear_states(context)
-        context.user_data[S_WAIT_CITY_SEARCH] = True
-        await q.edit_message_text(
-            "🔎 *Cities search*\n\nSend like:\n`country_code state`\nExample: `US CA`\nCancel: `/cancel`",
-            parse_mode="Markdown",
-        )
-        return
-
-    # -------- Static IP actions --------
-    if data == "static_get":
-        resp = api.get("/gateway/ip/get-static-ip")
-        ok, msg = ok_api(resp)
-        if not ok:
-            await q.edit_message_text(f"❌ Failed: {msg}\n```{pretty(resp)}```", parse_mode="Markdown", reply_markup=static_menu())
-            return
-        await q.edit_message_text(f"🧷 *Static IPs*\n```{pretty(resp['json'])}```", parse_mode="Markdown", reply_markup=static_menu())
-        return
-
-    if data == "static_filter":
-        clear_states(context)
-        context.user_data[S_WAIT_STATIC_FILTER] = True
-        await q.edit_message_text(
-            "⚙️ *Static IP filters*\n\n"
-            "Send JSON filters (any of these):\n"
-            "`{\"country_code\":\"US\",\"product_type\":25,\"page\":1,\"size\":20}`\n\n"
-            "product_type: 25=Static Residential, 14=Datacenter\n"
-            "status: 1 valid, 2 invalid, 3 expiring, 4 maintenance\n\n"
-            "Cancel: `/cancel`",
-            parse_mode="Markdown",
-        )
-        return
-
-    await q.edit_message_text("⚠️ Unknown action", reply_markup=menu(True))
 
+# ----------------- Bulk accounts -----------------
+def split_accounts(text: str, pattern: re.Pattern) -> Tuple[List[str], List[str]]:
+    """
+    "user01:pass, user02:pass" (commas or newlines) -> (entries, invalid entries).
+    Blank and repeated entries are dropped.
+    """
+    items = list(dict.fromkeys(a for a in (p.strip() for p in text.replace("\n", ",").split(",")) if a))
+    return items, [a for a in items if not pattern.match(a)]
+
+async def post_accounts(update: Update, api: BestProxyAPI, path: str, text: str, pattern: re.Pattern,
+                        icon: str, extra: Optional[Dict[str, Any]] = None):
+    # bad input is rejected here instead of costing an API round-trip; large
+    # lists go out as concurrent POSTs of ACCOUNTS_PER_POST entries
+    items, bad = split_accounts(text, pattern)
+    if not items or bad:
+        shown = ", ".join(bad[:5]) + (" …" if len(bad) > 5 else "")
+        msg = f"⚠️ Invalid entries: <code>{html.escape(shown, quote=False)}</code>" if bad else "⚠️ No accounts given"
+        await update.message.reply_text(msg, parse_mode="HTML", reply_markup=ACC_MENU)
+        return
+    batches = [",".join(items[i:i + ACCOUNTS_PER_POST]) for i in range(0, len(items), ACCOUNTS_PER_POST)]
+    resps = await asyncio.gather(*(api.apost(path, body={"accounts": b, **(extra or {})}) for b in batches),
+                                 return_exceptions=True)
+    # one section per batch, so a failed batch is reported next to the ones
+    # that already went through
+    max_len = max(200, 3500 // len(batches))
+    parts = []
+    for n, resp in enumerate(resps, 1):
+        head = f"{icon} Result:" if len(batches) == 1 else f"{icon} Batch {n}/{len(batches)}:"
+        if isinstance(resp, Exception):
+            parts.append(f"{head}\n❌ Failed: {type(resp).__name__}")
+        else:
+            parts.append(f"{head}\n{pre(resp, max_len=max_len)}")
+    await update.message.reply_text("\n\n".join(parts), parse_mode="HTML", reply_markup=ACC_MENU)
 
 # ----------------- Text handler (User inputs) -----------------
 async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -466,11 +690,25 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # save key
     if context.user_data.get(S_WAIT_KEY):
         context.user_data[S_WAIT_KEY] = False
-        db_set_key(tg_id, text)
+        await key_writer.process(tg_id, text)
+        drop_api(tg_id)
+        # check the key and warm the cache for the first menu clicks in one round-trip
+        api = await aget_api(update)
+        check, _ = await api.get_many([
+            ("/gateway/whitelist-account/list", None),
+            ("/gateway/user-usage-flow/total", None),
+        ])
+        if isinstance(check, Exception):
+            await update.message.reply_text(f"⚠️ Key saved, but API check failed: {type(check).__name__}")
+            return
+        ok, msg = ok_api(check)
+        if not ok:
+            await update.message.reply_text(f"⚠️ Key saved, but API check failed: {msg}")
+            return
         await update.message.reply_text("✅ Connected! এখন /start দাও বা menu use করো 😄")
         return
 
-    api = get_api(update)
+    api = await aget_api(update)
     if not api:
         await update.message.reply_text("⚠️ Not connected. /start দিয়ে Connect করো।")
         return
@@ -478,28 +716,25 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Add accounts
     if context.user_data.get(S_WAIT_ADD_ACCOUNTS):
         context.user_data[S_WAIT_ADD_ACCOUNTS] = False
-        resp = api.post("/gateway/whitelist-account/add", body={"accounts": text, "remark": ""})
-        await update.message.reply_text(f"➕ Result:\n```{pretty(resp)}```", parse_mode="Markdown", reply_markup=acc_menu())
+        await post_accounts(update, api, "/gateway/whitelist-account/add", text, ACCOUNT_PASS_RE, "➕",
+                            extra={"remark": ""})
         return
 
     # Delete accounts
     if context.user_data.get(S_WAIT_DEL_ACCOUNTS):
         context.user_data[S_WAIT_DEL_ACCOUNTS] = False
-        resp = api.post("/gateway/whitelist-account/delete", body={"accounts": text})
-        await update.message.reply_text(f"🗑️ Result:\n```{pretty(resp)}```", parse_mode="Markdown", reply_markup=acc_menu())
+        await post_accounts(update, api, "/gateway/whitelist-account/delete", text, ACCOUNT_RE, "🗑️")
         return
 
     # Enable / Disable
     if context.user_data.get(S_WAIT_EN_ACCOUNTS):
         context.user_data[S_WAIT_EN_ACCOUNTS] = False
-        resp = api.post("/gateway/whitelist-account/enable", body={"accounts": text})
-        await update.message.reply_text(f"✅ Result:\n```{pretty(resp)}```", parse_mode="Markdown", reply_markup=acc_menu())
+        await post_accounts(update, api, "/gateway/whitelist-account/enable", text, ACCOUNT_RE, "✅")
         return
 
     if context.user_data.get(S_WAIT_DIS_ACCOUNTS):
         context.user_data[S_WAIT_DIS_ACCOUNTS] = False
-        resp = api.post("/gateway/whitelist-account/disable", body={"accounts": text})
-        await update.message.reply_text(f"🚫 Result:\n```{pretty(resp)}```", parse_mode="Markdown", reply_markup=acc_menu())
+        await post_accounts(update, api, "/gateway/whitelist-account/disable", text, ACCOUNT_RE, "🚫")
         return
 
     # Change password
@@ -511,8 +746,11 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         account = parts[0].strip()
         password = parts[1].strip()
-        resp = api.post("/gateway/whitelist-account/change-password", body={"account": account, "password": password})
-        await update.message.reply_text(f"🔑 Result:\n```{pretty(resp)}```", parse_mode="Markdown", reply_markup=acc_menu())
+        if not ACCOUNT_RE.match(account):
+            await update.message.reply_text("⚠️ Invalid username")
+            return
+        resp = await api.apost("/gateway/whitelist-account/change-password", body={"account": account, "password": password})
+        await update.message.reply_text(f"🔑 Result:\n{pre(resp)}", parse_mode="HTML", reply_markup=ACC_MENU)
         return
 
     # Change remark
@@ -524,8 +762,11 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         left, remark = text.split("|", 1)
         account = left.strip()
         remark = remark.strip()
-        resp = api.post("/gateway/whitelist-account/change-remark", body={"account": account, "remark": remark})
-        await update.message.reply_text(f"📝 Result:\n```{pretty(resp)}```", parse_mode="Markdown", reply_markup=acc_menu())
+        if not ACCOUNT_RE.match(account):
+            await update.message.reply_text("⚠️ Invalid username")
+            return
+        resp = await api.apost("/gateway/whitelist-account/change-remark", body={"account": account, "remark": remark})
+        await update.message.reply_text(f"📝 Result:\n{pre(resp)}", parse_mode="HTML", reply_markup=ACC_MENU)
         return
 
     # Change limit
@@ -536,28 +777,38 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("⚠️ Format: `username limitGB`", parse_mode="Markdown")
             return
         account = parts[0].strip()
+        if not ACCOUNT_RE.match(account):
+            await update.message.reply_text("⚠️ Invalid username")
+            return
         try:
             limit = int(parts[1].strip())
         except ValueError:
             await update.message.reply_text("⚠️ limitGB must be number", parse_mode="Markdown")
             return
-        resp = api.post("/gateway/whitelist-account/change-limit", body={"account": account, "limit": limit})
-        await update.message.reply_text(f"📦 Result:\n```{pretty(resp)}```", parse_mode="Markdown", reply_markup=acc_menu())
+        if limit < 0:
+            await update.message.reply_text("⚠️ limitGB must be 0 or more")
+            return
+        resp = await api.apost("/gateway/whitelist-account/change-limit", body={"account": account, "limit": limit})
+        await update.message.reply_text(f"📦 Result:\n{pre(resp)}", parse_mode="HTML", reply_markup=ACC_MENU)
         return
 
     # Custom flow start_time
     if context.user_data.get(S_WAIT_FLOW_START):
         context.user_data[S_WAIT_FLOW_START] = False
-        resp = api.get("/gateway/user-usage-flow/total", params={"start_time": text})
-        await update.message.reply_text(f"📊 Result:\n```{pretty(resp)}```", parse_mode="Markdown", reply_markup=flow_menu())
+        resp = await api.aget("/gateway/user-usage-flow/total", params={"start_time": text})
+        await update.message.reply_text(f"📊 Result:\n{pre(resp)}", parse_mode="HTML", reply_markup=FLOW_MENU)
         return
 
     # states search
     if context.user_data.get(S_WAIT_STATE_SEARCH):
         context.user_data[S_WAIT_STATE_SEARCH] = False
         cc = text.strip().upper()
-        resp = api.get("/gateway/ip/dynamic-states/search", params={"country_code": cc})
-        await update.message.reply_text(f"🔎 States:\n```{pretty(resp)}```", parse_mode="Markdown", reply_markup=loc_menu())
+        if not _CC_RE.match(cc):
+            await update.message.reply_text("⚠️ country_code must be 2 letters (example: `US`)", parse_mode="Markdown")
+            return
+        resp = await api.aget("/gateway/ip/dynamic-states/search", params={"country_code": cc})
+        await update.message.reply_text(f"🔎 States:\n{pre(resp)}", parse_mode="HTML", reply_markup=LOC_MENU)
+        await send_full(update.message, resp, f"states_{cc}.json")
         return
 
     # cities search
@@ -569,35 +820,69 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         cc = parts[0].strip().upper()
         st = parts[1].strip()
-        resp = api.get("/gateway/ip/dynamic-citys/search", params={"country_code": cc, "state": st})
-        await update.message.reply_text(f"🔎 Cities:\n```{pretty(resp)}```", parse_mode="Markdown", reply_markup=loc_menu())
+        if not _CC_RE.match(cc):
+            await update.message.reply_text("⚠️ country_code must be 2 letters (example: `US CA`)", parse_mode="Markdown")
+            return
+        resp = await api.aget("/gateway/ip/dynamic-citys/search", params={"country_code": cc, "state": st})
+        await update.message.reply_text(f"🔎 Cities:\n{pre(resp)}", parse_mode="HTML", reply_markup=LOC_MENU)
+        await send_full(update.message, resp, f"cities_{cc}.json")
         return
 
     # static filter
     if context.user_data.get(S_WAIT_STATIC_FILTER):
         context.user_data[S_WAIT_STATIC_FILTER] = False
         try:
-            filters_json = json.loads(text)
+            filters_json = orjson.loads(text)
             if not isinstance(filters_json, dict):
                 raise ValueError()
-        except Exception:
+        except ValueError:  # includes orjson.JSONDecodeError
             await update.message.reply_text("⚠️ Please send valid JSON object.", parse_mode="Markdown")
             return
-        resp = api.get("/gateway/ip/get-static-ip", params=filters_json)
-        await update.message.reply_text(f"🧷 Result:\n```{pretty(resp)}```", parse_mode="Markdown", reply_markup=static_menu())
+        resp = await api.aget("/gateway/ip/get-static-ip", params=filters_json)
+        await update.message.reply_text(f"🧷 Result:\n{pre(resp)}", parse_mode="HTML", reply_markup=STATIC_MENU)
         return
 
     # default
     await update.message.reply_text("✅ Menu use করো: /start")
 
 # ----------------- main -----------------
+async def post_init(app):
+    # asyncio.to_thread runs on the loop's default executor, which is only
+    # min(32, cpus + 4) threads; give it room for concurrent upstream calls
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix="bestproxy")
+    )
+
 def main():
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
     db_init()
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .connection_pool_size(256)
+        .pool_timeout(30)
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .build()
+    )
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("cancel", cmd_cancel))
     app.add_handler(CallbackQueryHandler(on_btn))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text))
+    if PUBLIC_URL:
+        # Telegram pushes updates over up to 100 parallel connections
+        print("✅ Bot running (webhook)...")
+        app.run_webhook(
+            listen="0.0.0.0",
+            port=PORT,
+            url_path=BOT_TOKEN,
+            webhook_url=f"{PUBLIC_URL}/{BOT_TOKEN}",
+            max_connections=100,
+            secret_token=WEBHOOK_SECRET,
+            close_loop=False,
+        )
+        return
     print("✅ Bot running...")
     app.run_polling(close_loop=False)
 
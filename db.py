@@ -0,0 +1,203 @@
+import os
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from typing import Optional, Dict, Tuple, List, Union
+
+from dotenv import load_dotenv
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# ----------------- ENV -----------------
+load_dotenv()
+FERNET_SECRET = os.getenv("FERNET_SECRET", "").strip()
+DB_PATH = os.getenv("DB_PATH", "bestproxy_bot.db").strip()
+
+if not FERNET_SECRET:
+    raise SystemExit("❌ FERNET_SECRET missing in .env")
+
+# API keys are sealed with AES-GCM (12-byte nonce + ciphertext/tag, stored as a
+# BLOB). Fernet is kept only to read rows written by older versions, so it is
+# imported and set up on first use rather than at import.
+_fernet = None
+aead = AESGCM(hashlib.blake2b(FERNET_SECRET.encode(), digest_size=32, person=b"bestproxy-key").digest())
+
+def seal(api_key: str) -> bytes:
+    nonce = os.urandom(12)
+    return nonce + aead.encrypt(nonce, api_key.encode(), None)
+
+def unseal(blob: bytes) -> str:
+    return aead.decrypt(blob[:12], blob[12:], None).decode()
+
+def legacy_fernet():
+    global _fernet
+    if _fernet is None:
+        from cryptography.fernet import Fernet
+        _fernet = Fernet(FERNET_SECRET.encode())
+    return _fernet
+
+# ----------------- DB -----------------
+# Write-through cache of api_key_enc per user (None = not connected), so
+# "is this user connected?" costs one SQLite read per user per process.
+_KEY_CACHE: Dict[int, Optional[Union[str, bytes]]] = {}
+
+# One long-lived connection per thread (event loop + to_thread workers),
+# opened in WAL mode so readers don't block behind a writer. Connections run
+# in autocommit mode; multi-row writes open their own transaction.
+_LOCAL = threading.local()
+
+# Statements are module constants so every call passes the identical string
+# and hits the connection's prepared-statement cache.
+_SQL_UPSERT = """
+INSERT INTO users(tg_user_id, api_key_enc, updated_at)
+VALUES(?,?,datetime('now'))
+ON CONFLICT(tg_user_id) DO UPDATE SET
+    api_key_enc=excluded.api_key_enc,
+    updated_at=datetime('now')
+"""
+_SQL_SELECT = "SELECT api_key_enc FROM users WHERE tg_user_id=?"
+_SQL_DELETE = "DELETE FROM users WHERE tg_user_id=?"
+
+def db_conn() -> sqlite3.Connection:
+    conn = getattr(_LOCAL, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, isolation_level=None, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-20000")
+        conn.execute("PRAGMA mmap_size=67108864")
+        _LOCAL.conn = conn
+    return conn
+
+def db_init():
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS users(
+        tg_user_id INTEGER PRIMARY KEY,
+        api_key_enc BLOB,
+        created_at TEXT DEFAULT (datetime('now')),
+        updated_at TEXT DEFAULT (datetime('now'))
+    )
+    """)
+
+def db_set_key(tg_user_id: int, api_key: str):
+    db_set_keys([(tg_user_id, api_key)])
+
+def db_set_keys(items: List[Tuple[int, str]]):
+    _store_sealed([(tg_user_id, seal(api_key)) for tg_user_id, api_key in items])
+
+def _store_sealed(rows: List[Tuple[int, bytes]]):
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        cur.executemany(_SQL_UPSERT, rows)
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+    cur.execute("COMMIT")
+    for tg_user_id, api_key_enc in rows:
+        _KEY_CACHE[tg_user_id] = api_key_enc
+
+def db_get_enc(tg_user_id: int) -> Optional[Union[str, bytes]]:
+    if tg_user_id in _KEY_CACHE:
+        return _KEY_CACHE[tg_user_id]
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute(_SQL_SELECT, (tg_user_id,))
+    row = cur.fetchone()
+    enc = row[0] if row and row[0] else None
+    # a save/delete that finished while we were reading is newer: keep it
+    return _KEY_CACHE.setdefault(tg_user_id, enc)
+
+def db_get_key(tg_user_id: int) -> Optional[str]:
+    return db_get_key_enc(tg_user_id)[0]
+
+def db_get_key_enc(tg_user_id: int) -> Tuple[Optional[str], Optional[bytes]]:
+    """
+    (api_key, api_key_enc) from a single read, so the blob is always the one
+    the key was decrypted from even if a new key is saved meanwhile.
+    """
+    enc = db_get_enc(tg_user_id)
+    if not enc:
+        return None, None
+    if isinstance(enc, str):
+        # legacy Fernet token: decrypt once and re-seal with AES-GCM
+        api_key = legacy_fernet().decrypt(enc.encode()).decode()
+        blob = seal(api_key)
+        _store_sealed([(tg_user_id, blob)])
+        return api_key, blob
+    return unseal(enc), enc
+
+def is_connected(tg_user_id: int) -> bool:
+    return db_get_enc(tg_user_id) is not None
+
+def cached_enc(tg_user_id: int) -> Optional[Union[str, bytes]]:
+    # in-memory only: never touches SQLite
+    return _KEY_CACHE.get(tg_user_id)
+
+async def ais_connected(tg_user_id: int) -> bool:
+    # cache hits stay on the event loop; only a miss goes to the thread pool
+    if tg_user_id in _KEY_CACHE:
+        return _KEY_CACHE[tg_user_id] is not None
+    return await asyncio.to_thread(is_connected, tg_user_id)
+
+def db_delete_user(tg_user_id: int):
+    conn = db_conn()
+    cur = conn.cursor()
+    cur.execute(_SQL_DELETE, (tg_user_id,))
+    _KEY_CACHE[tg_user_id] = None
+
+class KeyWriteBatcher:
+    """
+    Coalesces key saves from many users into one transaction (one fsync):
+    a batch is committed when it reaches max_batch_size or max_queue_time
+    seconds after its first item. process() returns once its batch is stored.
+    """
+    def __init__(self, max_batch_size: int = 64, max_queue_time: float = 0.05):
+        self.max_batch_size = max_batch_size
+        self.max_queue_time = max_queue_time
+        self._pending: List[Tuple[int, str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+    async def process(self, tg_user_id: int, api_key: str):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((tg_user_id, api_key, fut))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_queue_time, self._flush)
+        await fut
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._commit(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _commit(self, batch: List[Tuple[int, str, asyncio.Future]]):
+        try:
+            await asyncio.to_thread(db_set_keys, [(tg_user_id, api_key) for tg_user_id, api_key, _ in batch])
+        except Exception as e:
+            for _, _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for _, _, fut in batch:
+            if not fut.done():
+                fut.set_result(None)
+
+key_writer = KeyWriteBatcher()
+
+if __name__ == "__main__":
+    # create/upgrade the schema without starting the bot
+    db_init()
+    print(f"✅ DB ready: {DB_PATH}")